@@ -1,18 +1,47 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import argparse
 import sys
+import shlex
+import shutil
 import subprocess
 import time
+import tempfile
 import logging
+import functools
+from collections import deque
 from pathlib import Path
 
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None  # Fall back to polling in wait_for_file()
+
 # -----------------------------------------------------------
 # Logging Setup
 # -----------------------------------------------------------
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+# Effective UID does not change during a wizard run, so check it once
+IS_ROOT = (os.geteuid() == 0)
+
+# Number of trailing output lines run_command() returns; everything is streamed to the log
+OUTPUT_TAIL_LINES = 50
+
+# Wizard steps that can be answered up front on the command line: (flag name, help text)
+WIZARD_STEPS = [
+    ("purge_tor", "purge old Tor configs"),
+    ("sync_time", "sync the system clock with ntpdate"),
+    ("disable_selinux", "disable SELinux if present"),
+    ("install_packages", "install Tor and security packages"),
+    ("write_torrc", "write a minimal /etc/tor/torrc"),
+    ("start_tor", "enable and start single-instance Tor"),
+    ("secure_server", "configure UFW, Fail2Ban and SSH password auth"),
+]
+
 # -----------------------------------------------------------
 # Helper Functions
 # -----------------------------------------------------------
@@ -21,14 +50,40 @@ def check_root():
     """
     Ensure the script is running as root, otherwise exit.
     """
-    if os.geteuid() != 0:
+    if not IS_ROOT:
         logger.error("This script must be run as root or with sudo privileges!")
         sys.exit(1)
 
-def ask_user(question):
+def parse_args(argv=None):
+    """
+    Parses command-line flags. Every wizard step gets --<step>/--no-<step>;
+    steps left unset are asked interactively. --all-yes answers yes to every unset step.
+    """
+    parser = argparse.ArgumentParser(
+        description="Single-instance Tor hidden service setup wizard."
+    )
+    parser.add_argument("-y", "--all-yes", action="store_true",
+                        help="answer yes to every step not set explicitly (non-interactive run)")
+    for key, help_text in WIZARD_STEPS:
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, default=None,
+                            action=argparse.BooleanOptionalAction, help=help_text)
+
+    args = parser.parse_args(argv)
+    if args.all_yes:
+        for key, _ in WIZARD_STEPS:
+            if getattr(args, key) is None:
+                setattr(args, key, True)
+    return args
+
+def ask_user(question, answer=None):
     """
     Simple Y/N prompt. Returns True if user answers 'y'/'yes', False if 'n'/'no'.
+    If 'answer' was already given (e.g. via a command-line flag), returns it without prompting.
     """
+    if answer is not None:
+        logger.info(f"{question} -> {'yes' if answer else 'no'} (from command line)")
+        return answer
+
     while True:
         choice = input(f"{question} [y/n]: ").strip().lower()
         if choice in ["y", "yes"]:
@@ -38,38 +93,95 @@ def ask_user(question):
         else:
             print("Please answer with y or n.")
 
-def run_command(command, exit_on_fail=True):
+def run_command(command, exit_on_fail=True, shell=False):
     """
-    Runs 'command' as 'sudo command' if not already root. Captures stdout/stderr in logs.
-    Returns stdout if success, else None (exits if exit_on_fail=True).
+    Runs 'command' as 'sudo command' if not already root. Streams stdout/stderr to the log.
+    'command' is an argv list (or a string, split with shlex) executed directly, without a shell.
+    Composite commands (pipes, '&&', globs) must be passed as a string with shell=True and run under 'bash -c'.
+    Returns the last OUTPUT_TAIL_LINES lines of output if success, else None (exits if exit_on_fail=True).
     """
-    # If already root, 'sudo' is optional, but we keep it for consistency
-    cmd_string = f"sudo {command}" if os.geteuid() != 0 else command
+    if shell:
+        argv = ["bash", "-c", command]
+    else:
+        # A plain string is split into words like a shell would, but never run through one
+        argv = shlex.split(command) if isinstance(command, str) else list(command)
+    logger.info(f"Executing command: {command if shell else shlex.join(argv)}")
 
-    logger.info(f"Executing command: {command}")
+    # If already root, 'sudo' is optional, but we keep it for consistency
+    if not IS_ROOT:
+        argv = ["sudo", *argv]
 
     env = os.environ.copy()
     env["DEBIAN_FRONTEND"] = "noninteractive"
 
     try:
-        result = subprocess.run(
-            cmd_string,
-            shell=True,
+        proc = subprocess.Popen(
+            argv,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1,
             text=True,
-            check=True,
-            capture_output=True,
             env=env
         )
-        stdout = result.stdout.strip()
-        if stdout:
-            for line in stdout.splitlines():
-                logger.debug(f"CMD-OUT: {line}")
-        return stdout
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Command failed: {e.stderr.strip()}")
+    except OSError as e:
+        logger.error(f"Command failed: {e}")
+        if exit_on_fail:
+            sys.exit(1)
+        return None
+
+    # Log output as it arrives (apt can print a lot); only the tail is kept for the caller
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    with proc:
+        for line in proc.stdout:
+            line = line.rstrip()
+            if line:
+                logger.info(f"CMD-OUT: {line}")
+                tail.append(line)
+
+    if proc.returncode != 0:
+        logger.error(f"Command failed with exit code {proc.returncode}: {tail[-1] if tail else ''}")
         if exit_on_fail:
             sys.exit(1)
         return None
+    return "\n".join(tail)
+
+def run_batch(commands, exit_on_fail=True, stop_on_error=True):
+    """
+    Runs several shell commands through a single 'bash -c' invocation instead of
+    spawning one shell per command. With stop_on_error the script aborts at the
+    first failing command ('set -e'); otherwise every command is attempted.
+    """
+    script = "; ".join(commands)
+    if stop_on_error:
+        script = f"set -e; {script}"
+    return run_command(script, exit_on_fail=exit_on_fail, shell=True)
+
+def set_config_line(path, pattern, line, exit_on_fail=True):
+    """
+    Replaces every line of config file 'path' matching regex 'pattern' with 'line',
+    in-process (the equivalent of "sed -i 's/pattern/line/' path"). Like sed, the new
+    content goes to a temp file in the same directory that is renamed over the original,
+    so a failed write leaves the config untouched.
+    Returns True on success (exits if exit_on_fail=True and the file can't be edited).
+    """
+    config = Path(path)
+    logger.info(f"Setting '{line}' in {config}")
+    tmp_path = None
+    try:
+        content = re.sub(pattern, lambda _: line, config.read_text(), flags=re.MULTILINE)
+        fd, tmp_path = tempfile.mkstemp(dir=config.parent, prefix=f".{config.name}.")
+        with os.fdopen(fd, "w") as tmp:
+            tmp.write(content)
+        shutil.copymode(config, tmp_path)
+        os.replace(tmp_path, config)
+        return True
+    except OSError as e:
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
+        logger.error(f"Could not edit {config}: {e}")
+        if exit_on_fail:
+            sys.exit(1)
+        return False
 
 def wizard_banner():
     """
@@ -82,22 +194,65 @@ def wizard_banner():
 ###################################################
 """)
 
+@functools.lru_cache(maxsize=1)
 def detect_selinux():
     """
     Returns True if SELinux is likely present/enabled, False otherwise.
-    Checks for setenforce & /etc/selinux/config.
+    Checks for setenforce & /etc/selinux/config. The result is cached per run.
     """
     # Quick check if 'setenforce' is available and /etc/selinux/config exists
     if Path("/etc/selinux/config").is_file():
-        setenforce_path = subprocess.run(
-            ["which", "setenforce"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        ).stdout.strip()
-        return bool(setenforce_path)
+        return shutil.which("setenforce") is not None
     return False
 
+def wait_for_file(path, timeout, poll_interval=5):
+    """
+    Blocks until 'path' exists or 'timeout' seconds have passed. Returns True if it appeared.
+    Uses inotify (via the optional inotify_simple package) to wake up as soon as the file
+    is created; otherwise polls every 'poll_interval' seconds.
+    """
+    deadline = time.monotonic() + timeout
+    watch_root = path.parent.parent
+
+    # Encode the path once; each check is then a bare stat() without Path overhead
+    path_bytes = os.fsencode(path)
+
+    def file_exists():
+        try:
+            os.stat(path_bytes)
+            return True
+        except FileNotFoundError:
+            return False
+
+    if inotify_simple is None or not watch_root.is_dir():
+        while not file_exists():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(poll_interval, remaining))
+        return True
+
+    mask = inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO
+    inotify = inotify_simple.INotify()
+    try:
+        # The parent directory may not exist yet (e.g. Tor has not created it),
+        # so watch the level above it as well until it shows up.
+        inotify.add_watch(watch_root, mask)
+        parent_watched = False
+        while True:
+            if not parent_watched and path.parent.is_dir():
+                inotify.add_watch(path.parent, mask)
+                parent_watched = True
+            # Check after adding watches so a file created in between is not missed
+            if file_exists():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            inotify.read(timeout=max(1, int(remaining * 1000)))
+    finally:
+        inotify.close()
+
 # -----------------------------------------------------------
 # Primary Steps
 # -----------------------------------------------------------
@@ -109,19 +264,19 @@ def purge_old_tor():
     """
     logger.info("Purging any old Tor or multi-instance config...")
 
-    # Disable old services
-    run_command("systemctl disable tor@default --now", exit_on_fail=False)
-    run_command("systemctl disable tor --now", exit_on_fail=False)
-
-    # Remove multi-instance directory if present
-    run_command("rm -rf /etc/tor/instances", exit_on_fail=False)
-
-    # Purge tor
-    run_command("apt-get purge -y tor", exit_on_fail=False)
-
-    # Clean leftover configs
-    run_command("rm -f /etc/tor/torrc /etc/tor/torrc.*", exit_on_fail=False)
-    run_command("rm -rf /var/lib/tor/*", exit_on_fail=False)
+    # Every step is best-effort, so keep going even if one of them fails
+    run_batch([
+        # Disable old services; separate calls so a missing unit doesn't block the other
+        "systemctl disable --now tor@default",
+        "systemctl disable --now tor",
+        # Remove multi-instance directory if present
+        "rm -rf /etc/tor/instances",
+        # Purge tor
+        "apt-get purge -y tor",
+        # Clean leftover configs
+        "rm -f /etc/tor/torrc /etc/tor/torrc.*",
+        "rm -rf /var/lib/tor/*",
+    ], exit_on_fail=False, stop_on_error=False)
 
     logger.info("Old tor configs purged.")
 
@@ -130,13 +285,13 @@ def fix_time():
     Installs ntpdate, forcibly syncs system clock, and enables NTP via timedatectl.
     """
     logger.info("Syncing system clock with ntpdate...")
-    run_command("apt-get update && apt-get install -y ntpdate", exit_on_fail=False)
-    out = run_command("ntpdate -u pool.ntp.org", exit_on_fail=False)
+    run_command("apt-get update && apt-get install -y --no-install-recommends ntpdate", exit_on_fail=False, shell=True)
+    out = run_command(["ntpdate", "-u", "pool.ntp.org"], exit_on_fail=False)
     if out:
         logger.info(f"ntpdate output: {out}")
     else:
         logger.warning("Time sync had no output; check network or logs.")
-    run_command("timedatectl set-ntp true", exit_on_fail=False)
+    run_command(["timedatectl", "set-ntp", "true"], exit_on_fail=False)
 
 def disable_selinux_if_present():
     """
@@ -146,19 +301,22 @@ def disable_selinux_if_present():
     logger.info("Checking if SELinux is present...")
     if detect_selinux():
         logger.info("SELinux detected; attempting to disable...")
-        run_command("setenforce 0", exit_on_fail=False)
-        run_command("sed -i 's/^SELINUX=.*/SELINUX=disabled/' /etc/selinux/config", exit_on_fail=False)
+        run_command(["setenforce", "0"], exit_on_fail=False)
+        set_config_line("/etc/selinux/config", r"^SELINUX=.*", "SELINUX=disabled", exit_on_fail=False)
         logger.info("SELinux set to permissive/disabled. A reboot may be required on some systems.")
     else:
         logger.info("SELinux not detected or not applicable. Skipping SELinux disable.")
 
 def install_tor_and_security():
     """
-    Installs single-instance Tor plus security tools: UFW, Fail2Ban, Git, Build-Essential, OpenSSL.
+    Installs single-instance Tor plus security tools: UFW, Fail2Ban, Git, OpenSSL.
+    Recommended packages are skipped, and so is build-essential since nothing is built from source;
+    the recommends the wizard relies on (logrotate for Tor's logs, python3-systemd for
+    Fail2Ban's journal backend) are listed explicitly.
     """
     logger.info("Installing Tor and security packages (ufw, fail2ban, etc.)...")
-    packages = ["tor", "ufw", "fail2ban", "git", "build-essential", "openssl"]
-    run_command(f"apt-get update && apt-get install -y {' '.join(packages)}")
+    packages = ["tor", "logrotate", "ufw", "fail2ban", "python3-systemd", "git", "openssl"]
+    run_command(f"apt-get update && apt-get install -y --no-install-recommends {' '.join(packages)}", shell=True)
     logger.info("Tor (single-instance) & security packages installed.")
 
 def write_minimal_torrc():
@@ -177,7 +335,6 @@ Log debug file /var/log/tor/debug.log
 HiddenServiceDir /var/lib/tor/hidden_service
 HiddenServicePort 80 127.0.0.1:80
 """
-    run_command("rm -f /etc/tor/torrc", exit_on_fail=False)
     Path("/etc/tor/torrc").write_text(minimal_conf)
     logger.info("Minimal torrc ready.")
 
@@ -188,22 +345,20 @@ def enable_tor_single_instance():
     Returns the onion address if found.
     """
     logger.info("Enabling single-instance tor.service...")
-    run_command("systemctl enable tor")
-    run_command("systemctl restart tor")
-
-    # Ensure log directory exists
-    run_command("mkdir -p /var/log/tor && chmod 755 /var/log/tor", exit_on_fail=False)
+    # Ensure log directory exists before Tor starts writing to it.
+    # Restart (not just 'enable --now') so a freshly written torrc is picked up.
+    run_batch([
+        "mkdir -p /var/log/tor",
+        "chmod 755 /var/log/tor",
+        "systemctl enable tor",
+        "systemctl restart tor",
+    ])
 
     hostname_file = Path("/var/lib/tor/hidden_service/hostname")
-    max_wait = 60
-    elapsed = 0
-    while elapsed < max_wait:
-        if hostname_file.exists():
-            onion_addr = hostname_file.read_text().strip()
-            logger.info(f"Your .onion address is: {onion_addr}")
-            return onion_addr
-        time.sleep(5)
-        elapsed += 5
+    if wait_for_file(hostname_file, timeout=60):
+        onion_addr = hostname_file.read_text().strip()
+        logger.info(f"Your .onion address is: {onion_addr}")
+        return onion_addr
 
     logger.error("No /var/lib/tor/hidden_service/hostname found after 60s. Check 'journalctl -u tor'.")
     sys.exit(1)
@@ -215,20 +370,22 @@ def secure_server():
     """
     logger.info("Configuring UFW, Fail2Ban, and SSH password auth...")
 
-    run_command("ufw default allow outgoing")
-    run_command("ufw default deny incoming")
-    run_command("ufw allow 22/tcp")
-    run_command("ufw allow 9050")
-    run_command("ufw allow 80")
-    run_command("ufw --force enable")
+    run_batch([
+        "ufw default allow outgoing",
+        "ufw default deny incoming",
+        "ufw allow 22/tcp",
+        "ufw allow 9050",
+        "ufw allow 80",
+        "ufw --force enable",
+    ])
     logger.info("UFW enabled. Inbound allowed only on ports 22, 9050, and 80.")
 
-    run_command("systemctl enable fail2ban && systemctl start fail2ban")
+    run_command(["systemctl", "enable", "--now", "fail2ban"])
     logger.info("Fail2Ban enabled.")
 
     # Keep SSH password auth for easier debugging. You can disable later.
-    run_command(r"sed -i 's/^#\?PasswordAuthentication.*/PasswordAuthentication yes/' /etc/ssh/sshd_config")
-    run_command("systemctl restart ssh")
+    set_config_line("/etc/ssh/sshd_config", r"^#?PasswordAuthentication.*", "PasswordAuthentication yes")
+    run_command(["systemctl", "restart", "ssh"])
     logger.info("SSH password auth is ON (for debugging). Remember to disable if needed.")
 
 # -----------------------------------------------------------
@@ -236,48 +393,49 @@ def secure_server():
 # -----------------------------------------------------------
 
 def main():
+    args = parse_args()  # Answers given up front skip their prompts
     check_root()       # Ensure script is run as root
     wizard_banner()    # Print the banner
 
     # Step A: Purge old Tor
-    if ask_user("Purge old Tor configs (recommended for a clean setup)?"):
+    if ask_user("Purge old Tor configs (recommended for a clean setup)?", args.purge_tor):
         purge_old_tor()
     else:
         logger.info("Skipping old Tor purge.")
 
     # Step B: Time sync
-    if ask_user("Sync system clock with ntpdate?"):
+    if ask_user("Sync system clock with ntpdate?", args.sync_time):
         fix_time()
     else:
         logger.info("Skipping time sync. Make sure your system clock is correct, or Tor might fail.")
 
     # Step C: Disable SELinux (if present)
-    if ask_user("Disable SELinux if present (recommended on RHEL/CentOS)?"):
+    if ask_user("Disable SELinux if present (recommended on RHEL/CentOS)?", args.disable_selinux):
         disable_selinux_if_present()
     else:
         logger.info("Skipping SELinux disable. If you have SELinux enforced, Tor might have issues.")
 
     # Step 1: Install Tor + security pkgs
-    if ask_user("Install Tor, UFW, Fail2Ban, Git, and other packages now?"):
+    if ask_user("Install Tor, UFW, Fail2Ban, Git, and other packages now?", args.install_packages):
         install_tor_and_security()
     else:
         logger.info("Skipping Tor & security package installation. Ensure Tor is installed manually.")
 
     # Step 2: Write minimal torrc
-    if ask_user("Write a minimal /etc/tor/torrc for a hidden service on port 80?"):
+    if ask_user("Write a minimal /etc/tor/torrc for a hidden service on port 80?", args.write_torrc):
         write_minimal_torrc()
     else:
         logger.info("Skipping minimal torrc. Make sure you have your own config in /etc/tor/torrc.")
 
     # Step 3: Start Tor, wait for onion address
-    if ask_user("Enable and start single-instance Tor now?"):
+    if ask_user("Enable and start single-instance Tor now?", args.start_tor):
         onion_addr = enable_tor_single_instance()
     else:
         logger.info("Skipping Tor start. Please ensure you manually enable and start Tor.")
         onion_addr = "UNAVAILABLE"
 
     # Step 4: Secure server (UFW + Fail2Ban + SSH Password auth)
-    if ask_user("Configure UFW, enable Fail2Ban, and ensure SSH password auth?"):
+    if ask_user("Configure UFW, enable Fail2Ban, and ensure SSH password auth?", args.secure_server):
         secure_server()
     else:
         logger.info("Skipping security steps. Make sure you have a firewall and Fail2Ban configured.")
@@ -6,8 +6,10 @@ on the root URL (/) and optionally configures it as a systemd service.
 
 import os
 import sys
+import shlex
 import subprocess
 import logging
+from collections import deque
 from pathlib import Path
 
 # -----------------------------------------------------------
@@ -16,6 +18,9 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+# Number of trailing output lines run_command() returns; everything is streamed to the log
+OUTPUT_TAIL_LINES = 50
+
 # -----------------------------------------------------------
 # Helper Functions
 # -----------------------------------------------------------
@@ -28,25 +33,45 @@ def check_root():
         logger.error("This script must be run as root (sudo)!")
         sys.exit(1)
 
-def run_command(cmd, exit_on_fail=True):
+def run_command(cmd, exit_on_fail=True, shell=False):
     """
-    Run a shell command with logging and optional exit on failure.
+    Run a command with logging and optional exit on failure.
+    'cmd' is an argv list (or a string, split with shlex) run without a shell;
+    pass a string with shell=True for composite commands such as 'a && b'. Output is streamed to the log
+    line by line; the last OUTPUT_TAIL_LINES lines are returned.
     """
-    logger.info(f"Executing command: {cmd}")
+    if not shell and isinstance(cmd, str):
+        cmd = shlex.split(cmd)
+    logger.info(f"Executing command: {cmd if shell else shlex.join(cmd)}")
     try:
-        result = subprocess.run(
+        proc = subprocess.Popen(
             cmd,
-            shell=True,
-            check=True,
-            text=True,
-            capture_output=True
+            shell=shell,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1,
+            text=True
         )
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Command failed: {e.stderr.strip()}")
+    except OSError as e:
+        logger.error(f"Command failed: {e}")
+        if exit_on_fail:
+            sys.exit(1)
+        return None
+
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    with proc:
+        for line in proc.stdout:
+            line = line.rstrip()
+            if line:
+                logger.info(f"CMD-OUT: {line}")
+                tail.append(line)
+
+    if proc.returncode != 0:
+        logger.error(f"Command failed with exit code {proc.returncode}: {tail[-1] if tail else ''}")
         if exit_on_fail:
             sys.exit(1)
         return None
+    return "\n".join(tail)
 
 def ask_user(question):
     """
@@ -71,8 +96,7 @@ def install_flask():
     If python3-flask is available in apt, that might suffice.
     """
     logger.info("Updating apt and installing python3-flask...")
-    run_command("apt-get update")
-    run_command("apt-get install -y python3 python3-pip python3-flask")
+    run_command("apt-get update && apt-get install -y --no-install-recommends python3 python3-pip python3-flask", shell=True)
 
 def write_flask_app(target_dir="/opt/exfil0_landing", port=80):
     """
@@ -127,9 +151,14 @@ WantedBy=multi-user.target
     systemd_path.write_text(service_file)
 
     logger.info("Reloading systemd daemon and enabling service...")
-    run_command("systemctl daemon-reload")
-    run_command(f"systemctl enable {service_name}")
-    run_command(f"systemctl restart {service_name}")
+    # One shell for the whole sequence; restart (rather than 'enable --now')
+    # so a redeployed app.py is picked up when the service is already running.
+    # service_name comes from user input, so quote it for the shell
+    unit = shlex.quote(service_name)
+    run_command(
+        f"systemctl daemon-reload && systemctl enable {unit} && systemctl restart {unit}",
+        shell=True
+    )
     logger.info(f"Systemd service '{service_name}' started and enabled.")
 
 # -----------------------------------------------------------
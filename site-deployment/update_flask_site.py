@@ -4,7 +4,10 @@ Wizard to modify the content or code of the existing Flask site.
 """
 
 import os
+import re
 import sys
+import shlex
+import shutil
 import subprocess
 import logging
 from pathlib import Path
@@ -15,6 +18,12 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+# Matches the landing route's `return "...", 200` line; group 1 keeps the indentation and 'return '
+LANDING_RETURN_RE = re.compile(r'^([ \t]*return[ \t]+)"(?:[^"\\\n]|\\.)*"[ \t]*,[ \t]*200[ \t]*$', re.MULTILINE)
+
+# systemd ActiveState per service name, filled by get_service_states() for this run
+SERVICE_STATES = {}
+
 def check_root():
     """
     Ensure the script is running as root or via sudo if we intend to manipulate systemd services.
@@ -23,16 +32,24 @@ def check_root():
         logger.error("This script must be run as root (sudo) if you're using systemd services!")
         sys.exit(1)
 
-def run_command(cmd, exit_on_fail=True):
-    logger.info(f"Executing command: {cmd}")
+def run_command(cmd, exit_on_fail=True, shell=False):
+    # Without shell=True, a plain string is split into argv instead of being run by /bin/sh
+    if not shell and isinstance(cmd, str):
+        cmd = shlex.split(cmd)
+    logger.info(f"Executing command: {cmd if shell else shlex.join(cmd)}")
     try:
-        result = subprocess.run(cmd, shell=True, text=True, capture_output=True, check=True)
+        result = subprocess.run(cmd, shell=shell, text=True, capture_output=True, check=True)
         return result.stdout.strip()
     except subprocess.CalledProcessError as e:
         logger.error(f"Command failed: {e.stderr.strip()}")
         if exit_on_fail:
             sys.exit(1)
         return None
+    except OSError as e:
+        logger.error(f"Command failed: {e}")
+        if exit_on_fail:
+            sys.exit(1)
+        return None
 
 def ask_user(question):
     """
@@ -47,17 +64,33 @@ def ask_user(question):
         else:
             print("Please answer with y or n.")
 
+def get_service_states(names):
+    """
+    Returns {name: ActiveState} for the given systemd services, querying all uncached
+    ones with a single 'systemctl show' call. Unknown states are reported as 'unknown'.
+    """
+    missing = [name for name in names if name not in SERVICE_STATES]
+    if missing:
+        output = run_command(
+            ["systemctl", "show", "-p", "ActiveState", "--value", "--", *missing],
+            exit_on_fail=False
+        )
+        # One value per unit, in the order requested (blank lines separate units)
+        states = [line.strip() for line in (output or "").splitlines() if line.strip()]
+        if len(states) == len(missing):
+            SERVICE_STATES.update(zip(missing, states))
+    return {name: SERVICE_STATES.get(name, "unknown") for name in names}
+
 def stop_service_if_running(service_name):
     """
     Check if systemd service is active; if yes, ask user to stop it.
     """
     logger.info(f"Checking status of service '{service_name}'...")
-    status_cmd = f"systemctl is-active {service_name}"
-    result = run_command(status_cmd, exit_on_fail=False)
-    if result and "active" in result.lower():
+    if get_service_states([service_name])[service_name] == "active":
         logger.info(f"Service '{service_name}' is currently active.")
         if ask_user(f"Stop service '{service_name}' before editing the site?"):
-            run_command(f"systemctl stop {service_name}")
+            run_command(["systemctl", "stop", service_name])
+            SERVICE_STATES[service_name] = "inactive"
             logger.info(f"Service '{service_name}' stopped.")
     else:
         logger.info(f"Service '{service_name}' is not active or not found. Skipping stop.")
@@ -67,7 +100,8 @@ def restart_service(service_name):
     Attempt to restart the systemd service.
     """
     logger.info(f"Restarting service '{service_name}'...")
-    run_command(f"systemctl restart {service_name}", exit_on_fail=False)
+    run_command(["systemctl", "restart", service_name], exit_on_fail=False)
+    SERVICE_STATES.pop(service_name, None)
 
 def replace_entire_file(app_path):
     """
@@ -100,15 +134,17 @@ def replace_entire_file(app_path):
             return
         new_content = file_path.read_text()
 
-    # Backup existing file
+    # Backup existing file (copy, so app.py stays in place until the swap below)
     backup_path = app_path.with_suffix(".bak")
     if app_path.exists():
         logger.info(f"Backing up existing file to {backup_path}")
-        app_path.replace(backup_path)
+        shutil.copy2(app_path, backup_path)
 
-    # Write the new file
+    # Write the new file next to app.py, then atomically swap it in
     logger.info(f"Writing new Flask code to {app_path}")
-    app_path.write_text(new_content)
+    tmp_path = app_path.with_suffix(".new")
+    tmp_path.write_text(new_content)
+    os.replace(tmp_path, app_path)
     logger.info("File replaced successfully.")
 
 def edit_only_landing_content(app_path):
@@ -127,25 +163,14 @@ def edit_only_landing_content(app_path):
         logger.info("No new message provided; skipping.")
         return
 
-    original_content = app_path.read_text().splitlines()
-    updated_lines = []
-    replaced = False
-
-    for line in original_content:
-        # A naive approach: find a line that looks like 'return "xyz", 200'
-        # You can adjust this parsing logic if your route code is more complex.
-        if "return " in line and '"' in line and "," in line:
-            # Attempt a simplistic parse:
-            prefix = line.split('return')[0] + 'return '
-            # We'll build the updated line
-            new_line = f'{prefix}"{new_message}", 200'
-            updated_lines.append(new_line)
-            replaced = True
-        else:
-            updated_lines.append(line)
+    # Escape backslashes and quotes so the message stays a valid Python string literal
+    literal = new_message.replace("\\", "\\\\").replace('"', '\\"')
+    content, replaced = LANDING_RETURN_RE.subn(
+        lambda m: f'{m.group(1)}"{literal}", 200', app_path.read_text(), count=1
+    )
 
     if replaced:
-        app_path.write_text("\n".join(updated_lines) + "\n")
+        app_path.write_text(content)
         logger.info(f"Landing message updated to: {new_message}")
     else:
         logger.warning("Could not find a line to replace (no 'return \"...\", 200' pattern found).")